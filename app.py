@@ -1,7 +1,11 @@
+import asyncio
+from contextlib import suppress
 from fastapi import FastAPI, HTTPException
 from typing import List
-from database import sub_plans_collection, db, permissions_collection, user_subs_collection, usage_collection
+from database import sub_plans_collection, db, permissions_collection, user_subs_collection, usage_collection, create_indexes
 from bson import ObjectId
+from cache import watch_config_versions
+from cascade import resume_cascade_jobs
 from routers import plans, permissions, subscriptions, access_control, usage, admin
 app = FastAPI()
 # Notes to self, move MongoDV logic to util.py
@@ -16,6 +20,25 @@ async def startup_db_client():
     except Exception as e:
         print(f"Error connecting to MongoDB: {e}")
 
+    # Make sure the analytics indexes exist
+    try:
+        await create_indexes()
+    except Exception as e:
+        print(f"Error creating MongoDB indexes: {e}")
+
+    # Keep this worker's caches in sync with admin edits made on other workers
+    app.state.config_watcher = asyncio.create_task(watch_config_versions())
+
+    # Keep picking up delete cascades left pending or abandoned by a stopped worker
+    app.state.cascade_resume = asyncio.create_task(resume_cascade_jobs())
+
+
+@app.on_event("shutdown")
+async def shutdown_background_tasks():
+    for task in (app.state.config_watcher, app.state.cascade_resume):
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
 
 
 
@@ -0,0 +1,148 @@
+import asyncio
+import time
+from database import config_versions_collection
+
+# Small in-process cache with a short TTL
+# Used for admin analytics results so dashboard refreshes don't rerun the pipelines
+
+DEFAULT_TTL_SECONDS = 30
+
+# Upper bound on entries per worker; the soonest-to-expire entries are evicted first
+MAX_CACHE_ENTRIES = 256
+
+# How often each worker polls the config version document when change streams aren't available
+CONFIG_POLL_SECONDS = 5
+
+# Backoff before re-opening a change stream that failed, doubling up to the max
+CHANGE_STREAM_RETRY_SECONDS = 30
+CHANGE_STREAM_MAX_RETRY_SECONDS = 600
+
+# Single document holding a version counter per entity ("plans", "permissions", "subscriptions")
+CONFIG_VERSIONS_ID = "config"
+
+_cache = {}
+
+# Entity name -> set of cache keys built from that entity
+_entity_keys = {}
+
+# Last versions this worker has seen
+_known_versions = {}
+
+
+def get_cached(key: str):
+    entry = _cache.get(key)
+    if not entry:
+        return None
+
+    value, expires_at = entry
+    if time.monotonic() >= expires_at:
+        # Entry expired, drop it
+        _drop_key(key)
+        return None
+    return value
+
+
+def _drop_key(key: str):
+    _cache.pop(key, None)
+    for keys in _entity_keys.values():
+        keys.discard(key)
+
+
+# Remove expired entries, then evict until there is room for one more
+def _sweep_cache():
+    now = time.monotonic()
+    for key in [key for key, (_, expires_at) in _cache.items() if now >= expires_at]:
+        _drop_key(key)
+
+    while len(_cache) >= MAX_CACHE_ENTRIES:
+        _drop_key(min(_cache, key=lambda key: _cache[key][1]))
+
+
+# entities lists what the cached value was built from so admin edits can invalidate it
+def set_cached(key: str, value, ttl: int = DEFAULT_TTL_SECONDS, entities=()):
+    _sweep_cache()
+    _cache[key] = (value, time.monotonic() + ttl)
+    for entity in entities:
+        _entity_keys.setdefault(entity, set()).add(key)
+    return value
+
+
+def invalidate_entity(entity: str):
+    # _drop_key also removes the key from every other entity's set
+    for key in _entity_keys.pop(entity, set()):
+        _drop_key(key)
+
+
+def clear_cache():
+    _cache.clear()
+    _entity_keys.clear()
+
+
+# Compare the versions document against what this worker has seen
+# and drop cached entries for every entity that changed
+def apply_config_versions(versions: dict):
+    for entity, version in versions.items():
+        if _known_versions.get(entity) != version:
+            _known_versions[entity] = version
+            invalidate_entity(entity)
+
+
+# Bump the version of an entity after an admin write
+# Other workers pick the change up through watch_config_versions
+async def bump_config_version(entity: str):
+    await config_versions_collection.update_one(
+        {"_id": CONFIG_VERSIONS_ID},
+        {"$inc": {f"versions.{entity}": 1}},
+        upsert=True
+    )
+    # No need to wait for the poll on the worker that made the change
+    invalidate_entity(entity)
+
+
+async def _load_config_versions():
+    doc = await config_versions_collection.find_one({"_id": CONFIG_VERSIONS_ID})
+    apply_config_versions(doc.get("versions", {}) if doc else {})
+
+
+async def _watch_change_stream():
+    pipeline = [{"$match": {"documentKey._id": CONFIG_VERSIONS_ID}}]
+    async with config_versions_collection.watch(pipeline, full_document="updateLookup") as stream:
+        # Catch anything that changed before the stream was opened
+        await _load_config_versions()
+        async for change in stream:
+            doc = change.get("fullDocument") or {}
+            apply_config_versions(doc.get("versions", {}))
+
+
+# Poll the versions document for the given number of seconds
+async def _poll_config_versions(duration: float):
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        try:
+            await _load_config_versions()
+        except Exception as e:
+            print(f"Error polling config versions: {e}")
+        await asyncio.sleep(CONFIG_POLL_SECONDS)
+
+
+# Background task started on app startup
+# Uses a change stream when the deployment supports it (replica set / Atlas).
+# When the stream fails (unsupported deployment or a dropped connection) the worker
+# polls the versions document for a while, then tries the change stream again
+async def watch_config_versions():
+    backoff = CHANGE_STREAM_RETRY_SECONDS
+    while True:
+        opened_at = time.monotonic()
+        try:
+            await _watch_change_stream()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Config version change stream stopped, polling for {backoff}s: {e}")
+
+        # A stream that stayed healthy for a while resets the backoff
+        if time.monotonic() - opened_at >= CHANGE_STREAM_MAX_RETRY_SECONDS:
+            backoff = CHANGE_STREAM_RETRY_SECONDS
+
+        await _poll_config_versions(backoff)
+        backoff = min(backoff * 2, CHANGE_STREAM_MAX_RETRY_SECONDS)
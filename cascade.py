@@ -0,0 +1,211 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo import DeleteOne, ReturnDocument
+from database import cascade_jobs_collection, sub_plans_collection, user_subs_collection, usage_collection, permissions_collection
+from cache import bump_config_version
+
+# Background cleanup after deleting a permission or a plan
+# Every step is safe to run again, so a failed or interrupted job can simply be retried
+
+# How many subscriptions are removed per bulk_write when cascading a plan delete
+CASCADE_BATCH_SIZE = 1000
+
+# A running job whose heartbeat is older than this is treated as abandoned and can be claimed again
+CASCADE_LEASE_SECONDS = 300
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+# Job ids are derived from the deleted document so retries reuse the same job record
+def permission_job_id(permission_id: str):
+    return f"delete-permission-{permission_id}"
+
+
+def plan_job_id(plan_id: str):
+    return f"delete-plan-{plan_id}"
+
+
+# Create (or reset) the job record before the source document is deleted
+# so the cascade can always be retried, even if a later write in the request fails
+async def create_cascade_job(job_id: str, job_type: str, target: dict):
+    await cascade_jobs_collection.update_one(
+        {"_id": job_id},
+        {
+            "$set": {
+                "type": job_type,
+                "target": target,
+                "status": "pending",
+                "error": None,
+                "updated_at": _now()
+            },
+            "$setOnInsert": {"created_at": _now(), "progress": {}}
+        },
+        upsert=True
+    )
+    return job_id
+
+
+# Atomically mark a job as running; returns None if another run holds a live lease
+async def claim_cascade_job(job_id: str):
+    now = _now()
+    return await cascade_jobs_collection.find_one_and_update(
+        {
+            "_id": job_id,
+            "$or": [
+                {"status": {"$ne": "running"}},
+                {"heartbeat_at": {"$lt": now - timedelta(seconds=CASCADE_LEASE_SECONDS)}}
+            ]
+        },
+        {"$set": {"status": "running", "error": None, "started_at": now, "heartbeat_at": now, "updated_at": now}},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def _set_status(job_id: str, status: str, error: str = None):
+    await cascade_jobs_collection.update_one(
+        {"_id": job_id},
+        {"$set": {"status": status, "error": error, "updated_at": _now()}}
+    )
+
+
+# Progress updates double as the heartbeat that keeps the lease alive
+async def _record_progress(job_id: str, step: str, count: int):
+    await cascade_jobs_collection.update_one(
+        {"_id": job_id},
+        {"$inc": {f"progress.{step}": count}, "$set": {"heartbeat_at": _now(), "updated_at": _now()}}
+    )
+
+
+# Pull the deleted permission out of every plan and every user subscription
+# Matches on name like remove_permission_from_user_plan; permission names are unique
+# and plan copies may carry their own description
+async def _cascade_permission(job_id: str, target: dict):
+    name = target["name"]
+
+    result = await sub_plans_collection.update_many(
+        {"permissions.name": name},
+        {"$pull": {"permissions": {"name": name}}}
+    )
+    await _record_progress(job_id, "plans_updated", result.modified_count)
+
+    result = await user_subs_collection.update_many(
+        {"permissions.name": name},
+        {"$pull": {"permissions": {"name": name}}}
+    )
+    await _record_progress(job_id, "subscriptions_updated", result.modified_count)
+
+    await bump_config_version("plans")
+    await bump_config_version("subscriptions")
+
+
+# Delete usage for users in the batch who no longer have any subscription,
+# then clear the batch from the job record
+async def _cascade_plan_usage(job_id: str, user_ids: list):
+    still_subscribed = set(await user_subs_collection.distinct("user_id", {"user_id": {"$in": user_ids}}))
+    orphaned = [user_id for user_id in user_ids if user_id not in still_subscribed]
+
+    result = await usage_collection.delete_many({"user_id": {"$in": orphaned}})
+    await cascade_jobs_collection.update_one({"_id": job_id}, {"$unset": {"current_batch": ""}})
+    await _record_progress(job_id, "usage_deleted", result.deleted_count)
+
+
+# Remove the subscriptions and usage records left behind by a deleted plan
+# Each batch is saved on the job before its subscriptions are deleted, so a retry can
+# finish the usage cleanup for a batch that was interrupted halfway
+async def _cascade_plan(job_id: str, target: dict):
+    plan_id = target["plan_id"]
+
+    job = await cascade_jobs_collection.find_one({"_id": job_id}, {"current_batch": 1})
+    if job and job.get("current_batch"):
+        await _cascade_plan_usage(job_id, job["current_batch"])
+
+    while True:
+        batch = await user_subs_collection.find(
+            {"plan_id": plan_id}, {"user_id": 1}
+        ).limit(CASCADE_BATCH_SIZE).to_list(length=CASCADE_BATCH_SIZE)
+        if not batch:
+            break
+
+        user_ids = [sub["user_id"] for sub in batch]
+        await cascade_jobs_collection.update_one({"_id": job_id}, {"$set": {"current_batch": user_ids}})
+
+        # plan_id guard: a user moved to another plan since the find keeps their subscription
+        result = await user_subs_collection.bulk_write(
+            [DeleteOne({"_id": sub["_id"], "plan_id": plan_id}) for sub in batch], ordered=False
+        )
+        await _record_progress(job_id, "subscriptions_deleted", result.deleted_count)
+
+        await _cascade_plan_usage(job_id, user_ids)
+
+    await bump_config_version("subscriptions")
+
+
+# The cascade only runs once its source document is really gone
+async def _source_deleted(job: dict):
+    target = job["target"]
+    if job["type"] == "delete_permission":
+        # A permission recreated under the same name would lose its copies too, so wait
+        return await permissions_collection.find_one({"$or": [
+            {"_id": ObjectId(target["permission_id"])},
+            {"name": target["name"]}
+        ]}) is None
+    return await sub_plans_collection.find_one({"_id": ObjectId(target["plan_id"])}) is None
+
+
+CASCADE_HANDLERS = {
+    "delete_permission": _cascade_permission,
+    "delete_plan": _cascade_plan
+}
+
+
+# Run a job that has already been claimed
+async def execute_cascade_job(job: dict):
+    job_id = job["_id"]
+    try:
+        if not await _source_deleted(job):
+            # The delete hasn't happened (yet) or the name was reused, leave the job pending
+            await _set_status(job_id, "pending")
+            return
+        await CASCADE_HANDLERS[job["type"]](job_id, job["target"])
+    except Exception as e:
+        print(f"Cascade job {job_id} failed: {e}")
+        await _set_status(job_id, "failed", str(e))
+        return
+
+    await _set_status(job_id, "completed")
+
+
+# Claim and run a job; used by BackgroundTasks after a delete and by the resume loop
+async def run_cascade_job(job_id: str):
+    job = await claim_cascade_job(job_id)
+    if job:
+        await execute_cascade_job(job)
+
+
+# Pick up jobs left pending or abandoned mid-run by a worker that stopped
+# Only pending jobs older than the lease are taken, so a delete request still in flight
+# on another worker schedules its own job. Claiming is atomic, so several workers
+# scanning together won't run the same job twice
+async def _resume_stale_cascade_jobs():
+    stale = _now() - timedelta(seconds=CASCADE_LEASE_SECONDS)
+    job_ids = await cascade_jobs_collection.distinct("_id", {"$or": [
+        {"status": "pending", "updated_at": {"$lt": stale}},
+        {"status": "running", "heartbeat_at": {"$lt": stale}}
+    ]})
+    for job_id in job_ids:
+        await run_cascade_job(job_id)
+
+
+# Background task started on app startup
+# Scans once per lease interval so jobs interrupted by a quick worker restart
+# are resumed as soon as their lease runs out
+async def resume_cascade_jobs():
+    while True:
+        try:
+            await _resume_stale_cascade_jobs()
+        except Exception as e:
+            print(f"Error resuming cascade jobs: {e}")
+        await asyncio.sleep(CASCADE_LEASE_SECONDS)
@@ -14,4 +14,19 @@ permissions_collection = db['permissions']
 user_subs_collection = db['user_subs']
 access_collection = db['access']
 usage_collection = db['usage']
-user_collection = db["users"]
\ No newline at end of file
+user_collection = db["users"]
+config_versions_collection = db["config_versions"]
+cascade_jobs_collection = db["cascade_jobs"]
+
+
+# Indexes backing the lookups, admin analytics pipelines and delete cascades
+# create_index is a no-op when the index already exists
+async def create_indexes():
+    await usage_collection.create_index("user_id")
+    await usage_collection.create_index([("used", -1)])
+    await user_subs_collection.create_index("user_id")
+    await user_subs_collection.create_index("plan_id")
+    await user_subs_collection.create_index("permissions.name")
+    await sub_plans_collection.create_index("name")
+    await sub_plans_collection.create_index("permissions.name")
+    await user_collection.create_index("user_id")
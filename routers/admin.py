@@ -1,6 +1,8 @@
-from fastapi import APIRouter, HTTPException, Depends
-from database import usage_collection
+from fastapi import APIRouter, HTTPException, Depends, Query, BackgroundTasks
+from database import usage_collection, cascade_jobs_collection
 from utils import verify_admin
+from cache import get_cached, set_cached
+from cascade import claim_cascade_job, execute_cascade_job
 
 router = APIRouter()
 
@@ -26,3 +28,173 @@ async def reset_usage_limit(userId: str, admin: dict = Depends(verify_admin)):
         "used": 0,
         "status": "active"
     }
+
+
+# Analytics (Admin Only)
+# All of these run as aggregation pipelines on the server, one round trip each
+
+# Analytics join usage to subscriptions and plans, so edits to either drop the cached results
+ANALYTICS_ENTITIES = ("plans", "subscriptions")
+
+# Joins each usage record to its subscription and plan
+# plan_id is stored as a string on user_subs so it is converted before the lookup
+def _usage_with_plan_stages():
+    return [
+        {"$lookup": {
+            "from": "user_subs",
+            "localField": "user_id",
+            "foreignField": "user_id",
+            "as": "subscription"
+        }},
+        {"$unwind": {"path": "$subscription", "preserveNullAndEmptyArrays": True}},
+        {"$lookup": {
+            "from": "plans",
+            "let": {"plan_id": {"$convert": {
+                "input": "$subscription.plan_id",
+                "to": "objectId",
+                "onError": None,
+                "onNull": None
+            }}},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$_id", "$$plan_id"]}}},
+                {"$project": {"name": 1}}
+            ],
+            "as": "plan"
+        }},
+        {"$unwind": {"path": "$plan", "preserveNullAndEmptyArrays": True}}
+    ]
+
+
+# extra_fields are added to the projection on top of the common usage fields
+def _usage_projection(extra_fields: dict = None):
+    return {"$project": {
+        "_id": 0,
+        "user_id": 1,
+        "used": 1,
+        "usage_limit": 1,
+        "blocked": {"$ifNull": ["$blocked", False]},
+        "plan_name": {"$ifNull": ["$plan.name", None]},
+        **(extra_fields or {})
+    }}
+
+
+# Users with the highest usage
+@router.get("/analytics/top-consumers")
+async def top_consumers(limit: int = Query(10, ge=1, le=1000), admin: dict = Depends(verify_admin)):
+    cache_key = f"analytics:top-consumers:{limit}"
+    cached = get_cached(cache_key)
+    if cached is not None:
+        return cached
+
+    # Sort and limit before the lookups so only the top users get joined
+    pipeline = [
+        {"$sort": {"used": -1}},
+        {"$limit": limit},
+        *_usage_with_plan_stages(),
+        _usage_projection()
+    ]
+    results = await usage_collection.aggregate(pipeline).to_list(length=limit)
+
+    return set_cached(cache_key, {"limit": limit, "users": results}, entities=ANALYTICS_ENTITIES)
+
+
+# Utilization per plan
+@router.get("/analytics/plan-utilization")
+async def plan_utilization(admin: dict = Depends(verify_admin)):
+    cache_key = "analytics:plan-utilization"
+    cached = get_cached(cache_key)
+    if cached is not None:
+        return cached
+
+    pipeline = [
+        *_usage_with_plan_stages(),
+        {"$group": {
+            "_id": "$plan._id",
+            "plan_name": {"$first": "$plan.name"},
+            "subscribers": {"$sum": 1},
+            "total_used": {"$sum": "$used"},
+            "total_limit": {"$sum": "$usage_limit"},
+            "blocked_users": {"$sum": {"$cond": [{"$ifNull": ["$blocked", False]}, 1, 0]}}
+        }},
+        {"$project": {
+            "_id": 0,
+            "plan_id": {"$toString": "$_id"},
+            "plan_name": 1,
+            "subscribers": 1,
+            "total_used": 1,
+            "total_limit": 1,
+            "blocked_users": 1,
+            "utilization": {"$cond": [
+                {"$gt": ["$total_limit", 0]},
+                {"$divide": ["$total_used", "$total_limit"]},
+                0
+            ]}
+        }},
+        {"$sort": {"utilization": -1}}
+    ]
+    results = await usage_collection.aggregate(pipeline).to_list(length=None)
+
+    return set_cached(cache_key, {"plans": results}, entities=ANALYTICS_ENTITIES)
+
+
+# Users who are close to (or over) their usage limit
+@router.get("/analytics/near-limit")
+async def users_near_limit(
+    threshold: float = Query(0.9, gt=0, le=1),
+    limit: int = Query(100, ge=1, le=1000),
+    admin: dict = Depends(verify_admin)
+):
+    # Round the threshold so near-identical queries share a cache entry
+    threshold = max(round(threshold, 2), 0.01)
+    cache_key = f"analytics:near-limit:{threshold}:{limit}"
+    cached = get_cached(cache_key)
+    if cached is not None:
+        return cached
+
+    pipeline = [
+        {"$match": {
+            "usage_limit": {"$gt": 0},
+            "$expr": {"$gte": ["$used", {"$multiply": ["$usage_limit", threshold]}]}
+        }},
+        {"$addFields": {"utilization": {"$divide": ["$used", "$usage_limit"]}}},
+        {"$sort": {"utilization": -1}},
+        {"$limit": limit},
+        *_usage_with_plan_stages(),
+        _usage_projection({"utilization": 1})
+    ]
+    results = await usage_collection.aggregate(pipeline).to_list(length=limit)
+
+    return set_cached(cache_key, {"threshold": threshold, "limit": limit, "users": results}, entities=ANALYTICS_ENTITIES)
+
+
+# Cascade jobs (Admin Only)
+# Check the progress of a delete cascade
+@router.get("/jobs/{jobId}")
+async def get_cascade_job(jobId: str, admin: dict = Depends(verify_admin)):
+    job = await cascade_jobs_collection.find_one({"_id": jobId})
+    if not job:
+        raise HTTPException(status_code=404, detail="Cascade job not found.")
+
+    return {
+        "job_id": job["_id"],
+        "type": job["type"],
+        "target": job["target"],
+        "status": job["status"],
+        "progress": job.get("progress", {}),
+        "error": job.get("error")
+    }
+
+
+# Re-run a cascade job; every step is idempotent so this is safe after a failure
+# A job stuck in "running" can be retried once its heartbeat goes stale
+@router.post("/jobs/{jobId}/retry")
+async def retry_cascade_job(jobId: str, background_tasks: BackgroundTasks, admin: dict = Depends(verify_admin)):
+    # Claim the job atomically so concurrent retries don't both schedule it
+    job = await claim_cascade_job(jobId)
+    if not job:
+        if not await cascade_jobs_collection.find_one({"_id": jobId}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Cascade job not found.")
+        raise HTTPException(status_code=400, detail="Cascade job is already running.")
+
+    background_tasks.add_task(execute_cascade_job, job)
+    return {"message": f"Cascade job '{jobId}' scheduled to run again.", "job_id": jobId}
@@ -1,9 +1,11 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
 from models import Permission
 from database import permissions_collection, sub_plans_collection, user_subs_collection
 from utils import verify_admin, verify_customer
 from bson import ObjectId
 from bson.errors import InvalidId
+from cache import bump_config_version
+from cascade import create_cascade_job, run_cascade_job, permission_job_id
 
 
 router = APIRouter()
@@ -44,6 +46,7 @@ async def add_permission_to_user_plan(userId: str, permission_name: str, admin:
         {"user_id": userId},
         {"$addToSet": {"permissions": permission_to_add}}
     )
+    await bump_config_version("subscriptions")
 
     return {"message": f"Permission '{permission_name}' added to the user's plan successfully."}
 
@@ -65,24 +68,41 @@ async def remove_permission_from_user_plan(userId: str, permission_name: str, ad
     if result.modified_count == 0:
         raise HTTPException(status_code=400, detail="Permission not found in the user's plan.")
 
+    await bump_config_version("subscriptions")
+
     return {"message": f"Permission '{permission_name}' removed successfully from the user's plan."}
 
 # Done
 # Delete a permission
+# Copies embedded in plans and user subscriptions are pulled out by a background job
 @router.delete("/{permissionId}")
-async def delete_permission(permissionId: str, admin: dict = Depends(verify_admin)):
+async def delete_permission(permissionId: str, background_tasks: BackgroundTasks, admin: dict = Depends(verify_admin)):
 
     try:
         object_id = ObjectId(permissionId)
     except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid permission ID format.")
 
+    permission = await permissions_collection.find_one({"_id": object_id})
+    if not permission:
+        raise HTTPException(status_code=404, detail="Permission not found.")
+
+    # Record the cascade before deleting so it can always be retried
+    job_id = await create_cascade_job(
+        permission_job_id(permissionId),
+        "delete_permission",
+        {"permission_id": permissionId, "name": permission["name"]}
+    )
+
     # Delete the permission
     result = await permissions_collection.delete_one({"_id": object_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Permission not found.")
 
-    return {"message": "Global permission deleted successfully."}
+    background_tasks.add_task(run_cascade_job, job_id)
+    await bump_config_version("permissions")
+
+    return {"message": "Global permission deleted successfully.", "cascade_job_id": job_id}
 
 
 # Creating a new permission
@@ -102,6 +122,7 @@ async def create_permission(permission: Permission, admin: dict = Depends(verify
         "api_endpoint": permission.api_endpoint
     }
     result = await permissions_collection.insert_one(new_permission)
+    await bump_config_version("permissions")
 
     return {"message": "Permission created successfully", "permission_id": str(result.inserted_id)}
 
@@ -1,10 +1,12 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
 from models import CreatePlan
 from database import sub_plans_collection, permissions_collection
 from utils import get_by_id
 from bson import ObjectId
 from utils import verify_admin
 from bson.errors import InvalidId
+from cache import bump_config_version
+from cascade import create_cascade_job, run_cascade_job, plan_job_id
 
 router = APIRouter()
 
@@ -35,6 +37,7 @@ async def create_plan(plan: CreatePlan, user: dict = Depends(verify_admin)):
         "usage_limit": plan.usage_limit
     }
     result = await sub_plans_collection.insert_one(new_plan)
+    await bump_config_version("plans")
     return {"message": "Plan created successfully", "plan_id": str(result.inserted_id)}
 
 
@@ -61,24 +64,37 @@ async def modify_plan_partial(planId: str, update_fields: dict, user: dict = Dep
 
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Plan not updated")
-    
+
+    await bump_config_version("plans")
     return {"message": "Plan updated successfully", "updated_fields": update_fields}
 
 
 # Deleting a plan
+# Subscriptions and usage records on the plan are removed by a background job
 @router.delete("/{planId}")
-async def delete_plan(planId: str, user: dict = Depends(verify_admin)):
+async def delete_plan(planId: str, background_tasks: BackgroundTasks, user: dict = Depends(verify_admin)):
 
     try: 
         object_id = ObjectId(planId)
     except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid plan ID format")
 
+    existing_plan = await sub_plans_collection.find_one({"_id": object_id})
+    if not existing_plan:
+        raise HTTPException(status_code=404, detail="Plan not found")
+
+    # Record the cascade before deleting so it can always be retried
+    job_id = await create_cascade_job(plan_job_id(planId), "delete_plan", {"plan_id": planId})
+
     # Rewrote the logic
     result = await sub_plans_collection.delete_one({"_id": object_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Plan not found")
-    return {"message": "Plan deleted successfully"}
+
+    background_tasks.add_task(run_cascade_job, job_id)
+    await bump_config_version("plans")
+
+    return {"message": "Plan deleted successfully", "cascade_job_id": job_id}
 
 
 # Get all plans so user can see
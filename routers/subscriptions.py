@@ -3,6 +3,7 @@ from models import UserSub
 from database import user_subs_collection, sub_plans_collection, usage_collection
 from utils import get_plan_by_name, verify_admin, verify_customer
 from bson import ObjectId
+from cache import bump_config_version
 
 router = APIRouter()
 
@@ -28,6 +29,7 @@ async def subscribe_to_plan(plan_name: str, user: dict = Depends(verify_customer
         "plan_id": str(plan["_id"]),
     }
     await user_subs_collection.insert_one(new_sub)
+    await bump_config_version("subscriptions")
 
     # Initialize usage tracking
     result = await usage_collection.insert_one({
@@ -109,6 +111,7 @@ async def modify_subscription(userId: str, plan_name: str, admin: dict = Depends
             "used": 0
         })
 
+    await bump_config_version("subscriptions")
     return {"message": f"Subscription for user {userId} updated to plan '{plan_name}' successfully."}
 
 